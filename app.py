@@ -1,11 +1,14 @@
 import streamlit as st
 import time
-import yfinance as yf
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from datetime import datetime
-from supabase import create_client, Client
+from supabase import create_client
 from groq import Groq
-from sentence_transformers import SentenceTransformer
-from duckduckgo_search import DDGS
+from encoder import load_encoder, to_halfvec
+from search import search_ddgs
 
 # --- CONFIGURATION ---
 st.set_page_config(page_title="Sentinel Terminal", page_icon="🛡️", layout="wide")
@@ -23,9 +26,18 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- SETUP CREDENTIALS ---
+# Cached so reruns reuse the same HTTP connection pools
+@st.cache_resource
+def get_supabase():
+    return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+
+@st.cache_resource
+def get_groq():
+    return Groq(api_key=st.secrets["GROQ_API_KEY"])
+
 try:
-    supabase = create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
-    client = Groq(api_key=st.secrets["GROQ_API_KEY"])
+    supabase = get_supabase()
+    client = get_groq()
 except Exception as e:
     st.error(f"❌ Secrets missing: {e}")
     st.stop()
@@ -33,70 +45,197 @@ except Exception as e:
 # --- LOAD AI MODEL ---
 @st.cache_resource
 def load_model():
-    return SentenceTransformer('all-MiniLM-L6-v2')
+    # fp16 on CUDA if available, else INT8-quantized ONNX (see encoder.py)
+    return load_encoder()
 
 model = load_model()
 
+# Query vectors are deterministic, so reruns with the same prompt skip the encoder
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def embed_query(text: str) -> str:
+    return to_halfvec(model.encode(text, normalize_embeddings=True))
+
+def canonical_prompt(text):
+    # The tokenizer splits on whitespace anyway, so this can't change the vector
+    return " ".join(text.split())
+
+# --- FUNCTION: CACHED MARKET DATA ---
+@st.cache_data(ttl=10, show_spinner=False)
+def get_fast_info(ticker):
+    import yfinance as yf
+    info = yf.Ticker(ticker).fast_info
+    return info.last_price, info.previous_close
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_history(ticker):
+    import yfinance as yf
+    # Daily bars barely move between fragment ticks
+    return yf.Ticker(ticker).history(period="1mo", interval="1d")
+
 # --- FUNCTION: FETCH LIVE DATA (Native Streamlit Charts) ---
-@st.fragment(run_every=30)
-def show_market_data(ticker):
+# Price and chart refresh on separate cadences: the metric is cheap, the history isn't
+@st.fragment(run_every=15)
+def show_price(ticker):
     if not ticker: return
     try:
-        stock = yf.Ticker(ticker)
         # Get fast price info
-        info = stock.fast_info
-        price = info.last_price
-        change = price - info.previous_close
-        pct = (change / info.previous_close) * 100
-        
-        col1, col2 = st.columns([1, 3])
-        with col1:
-            # Native Streamlit Metric (Fast & Clean)
-            st.metric(f"{ticker} Price", f"${price:.2f}", f"{change:.2f} ({pct:.2f}%)")
-        
-        with col2:
-            # Native Streamlit Line Chart (No Plotly required)
-            hist = stock.history(period="1mo")
-            st.line_chart(hist['Close'], height=150, color="#00FF00")
-            
+        price, previous_close = get_fast_info(ticker)
+        change = price - previous_close
+        pct = (change / previous_close) * 100
+
+        # Native Streamlit Metric (Fast & Clean)
+        st.metric(f"{ticker} Price", f"${price:.2f}", f"{change:.2f} ({pct:.2f}%)")
+    except Exception:
+        st.warning("Waiting for market data...")
+
+@st.fragment(run_every=300)
+def show_sparkline(ticker):
+    if not ticker: return
+    try:
+        # Native Streamlit Line Chart (No Plotly required)
+        hist = get_history(ticker)
+        st.line_chart(hist['Close'], height=150, color="#00FF00")
     except Exception:
         st.warning("Waiting for market data...")
 
+def show_market_data(ticker):
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        show_price(ticker)
+    with col2:
+        show_sparkline(ticker)
+
+# --- BACKGROUND WORKERS ---
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource
+def get_warmup_executor():
+    # Kept apart from research so warm-ups never queue ahead of it
+    return ThreadPoolExecutor(max_workers=1)
+
+GROQ_KEEPALIVE = 5  # seconds httpx keeps the Groq client's idle connections open
+
+@st.cache_resource
+def get_groq_activity():
+    # Monotonic time of the last Groq request; shared across sessions, like the client
+    return {"last_call": 0.0}
+
+groq_activity = get_groq_activity()
+
+SEEN_ARTICLES_MAX = 5000  # digests kept in the LRU below
+
+@st.cache_resource
+def get_seen_articles():
+    # LRU of article-text hashes this process has already embedded and stored
+    return OrderedDict(), threading.Lock()
+
+seen_articles, seen_lock = get_seen_articles()
+
+def remember_articles(digests):
+    # Caller holds seen_lock
+    for digest in digests:
+        seen_articles[digest] = None
+        seen_articles.move_to_end(digest)
+    while len(seen_articles) > SEEN_ARTICLES_MAX:
+        seen_articles.popitem(last=False)
+
+def article_digest(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+RESEARCH_COOLDOWN = 60  # seconds to leave a ticker alone after every backend failed
+
 # --- FUNCTION: LIVE RESEARCHER (DuckDuckGo) ---
+# Runs on a worker thread, so no st.* calls in here
 def perform_live_research(ticker):
-    with st.status(f"🕵️ Agent researching {ticker}...", expanded=True) as status:
-        status.write("Searching internet...")
-        results = []
-        try:
-            with DDGS() as ddgs:
-                news_gen = ddgs.text(f"{ticker} stock news", max_results=5)
-                for r in news_gen:
-                    results.append(r)
-        except Exception as e:
-            status.update(label="Search Failed", state="error")
-            return
-
-        status.write("Memorizing data...")
-        new_rows = []
+    results = search_ddgs(ticker)
+
+    # Drop repeats within this search and articles we've already embedded
+    fresh = {}
+    with seen_lock:
         for article in results:
-            text = f"{article['title']}. {article['body']}"
-            embedding = model.encode(text).tolist()
-            
-            new_rows.append({
-                "ticker": ticker,
-                "headline": article['title'],
-                "content": article['body'],
-                "published_at": datetime.utcnow().isoformat(),
-                "embedding": embedding
-            })
-            
-        if new_rows:
-            try:
-                supabase.table('market_news').insert(new_rows).execute()
-            except Exception as e:
-                print(f"DB Insert Error: {e}")
-                
-        status.update(label="Knowledge Base Updated!", state="complete", expanded=False)
+            digest = article_digest(f"{article['title']}. {article['body']}")
+            if digest in seen_articles:
+                seen_articles.move_to_end(digest)
+            elif digest not in fresh:
+                fresh[digest] = article
+
+    # ...and anything already in the DB from an earlier run / the ETL job
+    if fresh:
+        try:
+            existing = supabase.table('market_news').select('headline') \
+                .eq('ticker', ticker.upper()) \
+                .in_('headline', [a['title'] for a in fresh.values()]) \
+                .execute()
+            stored = {row['headline'] for row in existing.data}
+        except Exception:
+            stored = set()
+        with seen_lock:
+            for digest, article in list(fresh.items()):
+                if article['title'] in stored:
+                    remember_articles([digest])
+                    del fresh[digest]
+
+    if not fresh:
+        return 0
+    results = list(fresh.values())
+
+    # One batched forward pass instead of one per article
+    texts = [f"{article['title']}. {article['body']}" for article in results]
+    embeddings = model.encode(texts, batch_size=32, convert_to_numpy=True,
+                              normalize_embeddings=True, show_progress_bar=False)
+
+    # Whole batch goes to Supabase in a single round-trip
+    now_iso = datetime.utcnow().isoformat()
+    new_rows = [
+        {
+            "ticker": ticker.upper(),
+            "headline": article['title'],
+            "content": article['body'],
+            "published_at": now_iso,
+            "embedding_half": to_halfvec(embedding)
+        }
+        for article, embedding in zip(results, embeddings)
+    ]
+
+    try:
+        response = supabase.table('market_news') \
+            .upsert(new_rows, on_conflict='ticker,headline', ignore_duplicates=True) \
+            .execute()
+    except Exception as e:
+        print(f"DB Insert Error: {e}")
+        return 0
+
+    with seen_lock:
+        remember_articles(fresh)
+    # Rows skipped as duplicates aren't in response.data
+    return len(response.data)
+
+# --- FUNCTION: VECTOR SEARCH ---
+def search_news(query_vector, ticker):
+    response = supabase.rpc(
+        'match_documents', 
+        {
+            'query_embedding': query_vector, 
+            'match_threshold': 0.5, 
+            'match_count': 5,
+            'filter_ticker': ticker
+        }
+    ).execute()
+    return response.data
+
+# --- PROMPTS ---
+# Kept byte-identical across turns; the retrieved context goes in its own message
+SYSTEM_PROMPT = (
+    "You are a financial analyst. Answer the user question based ONLY on the provided Context. "
+    "If the context doesn't answer it, say so."
+)
+CONTEXT_TEMPLATE = "Context: {ctx}"
+MAX_CONTEXT_CHARS = 800  # per article body; caps Groq input tokens
+NO_DATA_MESSAGE = "I don't have any data on this ticker yet. Try again in a moment."
+NO_DATA_TTL = 300  # seconds to remember that research turned up nothing
+NO_DATA_PREFIX = 64  # prompt characters that identify a repeat question
 
 # --- MAIN UI ---
 st.title("🛡️ Sentinel Terminal")
@@ -104,12 +243,20 @@ st.title("🛡️ Sentinel Terminal")
 # Ticker Input
 active_ticker = st.text_input("ACTIVE TICKER", value="NVDA").upper()
 
-# Show Data (Auto-refreshes every 30s)
+# Show Data (price every 15s, chart every 5 min)
 show_market_data(active_ticker)
 
 # --- CHAT LOGIC ---
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "pending_research" not in st.session_state:
+    st.session_state.pending_research = {}
+if "answer_cache" not in st.session_state:
+    st.session_state.answer_cache = {}
+if "ddgs_cooldown" not in st.session_state:
+    st.session_state.ddgs_cooldown = {}
+if "no_data" not in st.session_state:
+    st.session_state.no_data = {}
 
 # Display History
 for msg in st.session_state.messages:
@@ -128,63 +275,100 @@ if prompt := st.chat_input(f"Ask about {active_ticker}..."):
         message_placeholder = st.empty()
         
         # A. Encode Question
-        query_vector = model.encode(prompt).tolist()
+        query_vector = embed_query(canonical_prompt(prompt))
         
-        # B. Search Database (With Filter Fix)
-        try:
-            response = supabase.rpc(
-                'match_documents', 
-                {
-                    'query_embedding': query_vector, 
-                    'match_threshold': 0.5, 
-                    'match_count': 5,
-                    'filter_ticker': active_ticker
-                }
-            ).execute()
-            matches = response.data
-        except Exception:
-            # Fallback if SQL function isn't updated yet
-            matches = []
+        # B. Search Database (filtered to the active ticker server-side). If an answer
+        # will probably follow, a cheap Groq call opens/refreshes its connection in parallel
+        no_data_key = (active_ticker, canonical_prompt(prompt)[:NO_DATA_PREFIX])
+        expect_no_data = (st.session_state.no_data.get(no_data_key, 0) > time.time()
+                          or st.session_state.ddgs_cooldown.get(active_ticker, 0) > time.time())
+        if not expect_no_data and time.monotonic() - groq_activity["last_call"] > GROQ_KEEPALIVE:
+            groq_activity["last_call"] = time.monotonic()
+            get_warmup_executor().submit(client.models.list)
+        matches = search_news(query_vector, active_ticker)
 
-        # C. If No Data, Research & Retry
+        # C. If No Data, Research in the background & Retry if it finishes quickly
         if not matches:
-            perform_live_research(active_ticker)
-            # Retry Search
-            response = supabase.rpc(
-                'match_documents', 
-                {
-                    'query_embedding': query_vector, 
-                    'match_threshold': 0.5, 
-                    'match_count': 5,
-                    'filter_ticker': active_ticker
-                }
-            ).execute()
-            matches = response.data
+            research = st.session_state.pending_research.get(active_ticker)
+            if research is not None and research.done() and research.exception() is not None:
+                # A background search that finished after we stopped waiting still counts
+                st.session_state.ddgs_cooldown[active_ticker] = time.time() + RESEARCH_COOLDOWN
+                st.session_state.pending_research.pop(active_ticker, None)
+                research = None
+
+            if st.session_state.no_data.get(no_data_key, 0) > time.time():
+                # Just researched this and found nothing; don't scrape again yet
+                research = None
+            elif st.session_state.ddgs_cooldown.get(active_ticker, 0) > time.time():
+                research = None
+                st.status(f"Search paused for {active_ticker} after repeated failures", state="error")
+            elif research is None or research.done():
+                research = get_executor().submit(perform_live_research, active_ticker)
+                st.session_state.pending_research[active_ticker] = research
+
+            if research is not None:
+                with st.status(f"🕵️ Agent researching {active_ticker}...", expanded=True) as status:
+                    try:
+                        research.result(timeout=2.0)
+                    except FuturesTimeout:
+                        # Keep the future around; the next question will see the new rows
+                        status.update(label="Still researching in the background...", state="complete", expanded=False)
+                    except Exception:
+                        st.session_state.pending_research.pop(active_ticker, None)
+                        st.session_state.ddgs_cooldown[active_ticker] = time.time() + RESEARCH_COOLDOWN
+                        status.update(label="Search Failed", state="error")
+                    else:
+                        st.session_state.pending_research.pop(active_ticker, None)
+                        status.update(label="Knowledge Base Updated!", state="complete", expanded=False)
+                        # Retry Search
+                        matches = search_news(query_vector, active_ticker)
+                        if not matches:
+                            st.session_state.no_data[no_data_key] = time.time() + NO_DATA_TTL
 
         # D. Generate Answer
-        if matches:
-            context_str = "\n\n".join([f"Headline: {m['headline']}\nBody: {m['content']}" for m in matches])
+        if not matches:
+            # Nothing to ground an answer in, so skip the LLM call entirely
+            full_response = NO_DATA_MESSAGE
         else:
-            context_str = "No specific news found."
-
-        # Stream Response
-        stream = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": f"You are a financial analyst. Answer the user question based ONLY on the provided Context. If the context doesn't answer it, say so. Context: {context_str}"
-                },
-                {"role": "user", "content": prompt}
-            ],
-            stream=True
-        )
-        
-        full_response = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                full_response += chunk.choices[0].delta.content
-                message_placeholder.markdown(full_response + "▌")
+            # Reuse the answer if this exact question/context was already answered
+            answer_key = hashlib.blake2b(
+                f"{prompt}|{active_ticker}|{sorted(m['id'] for m in matches)}".encode()
+            ).hexdigest()
+
+            if answer_key in st.session_state.answer_cache:
+                full_response = st.session_state.answer_cache[answer_key]
+            else:
+                context_str = "\n\n".join(
+                    f"Headline: {m['headline']}\nBody: {m['content'][:MAX_CONTEXT_CHARS]}" for m in matches
+                )
+
+                # Stream Response
+                stream = client.chat.completions.create(
+                    model="llama-3.3-70b-versatile",
+                    messages=[
+                        # Static prefix first, per-query content last (prefix-cache friendly)
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": CONTEXT_TEMPLATE.format(ctx=context_str)},
+                        {"role": "user", "content": prompt}
+                    ],
+                    stream=True
+                )
+                
+                full_response = ""
+                # Re-render every few tokens / 50ms rather than on every single token
+                last_flush = time.monotonic()
+                pending = 0
+                for chunk in stream:
+                    if chunk.choices[0].delta.content:
+                        full_response += chunk.choices[0].delta.content
+                        pending += 1
+                        if pending >= 8 or time.monotonic() - last_flush > 0.05:
+                            message_placeholder.markdown(full_response + "▌")
+                            last_flush = time.monotonic()
+                            pending = 0
+                groq_activity["last_call"] = time.monotonic()
+
+                st.session_state.answer_cache[answer_key] = full_response
         
         message_placeholder.markdown(full_response)
         
@@ -0,0 +1,156 @@
+import os
+import threading
+import numpy as np
+# onnxruntime / transformers / optimum are imported where they're used, so that
+# importing this module (e.g. for to_halfvec) stays cheap
+
+# --- CONFIGURATION ---
+MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_DIR = os.environ.get("ENCODER_DIR", "models/miniLM-onnx-int8")
+QUANTIZED_FILE = "model_quantized.onnx"
+MAX_SEQ_LENGTH = 256  # Same limit SentenceTransformer uses for MiniLM
+MAX_CHARS = 2000  # Comfortably past 256 tokens; anything longer would be truncated anyway
+# Beyond ~8 threads a model this small spends more time syncing than computing
+NUM_THREADS = int(os.environ.get("ENCODER_THREADS", min(8, os.cpu_count() or 4)))
+
+
+# --- ONE-TIME EXPORT (PyTorch -> ONNX -> INT8) ---
+def export_quantized_model(model_id=MODEL_ID, save_dir=MODEL_DIR):
+    from transformers import AutoTokenizer
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    print(f"📦 Exporting {model_id} to ONNX (int8)...")
+    ort_model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+
+    # Dynamic quantization: weights stored as int8, activations scaled at runtime.
+    # The VNNI preset targets the int8 dot-product instructions on recent x86 CPUs.
+    quantizer = ORTQuantizer.from_pretrained(ort_model)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+
+    AutoTokenizer.from_pretrained(model_id).save_pretrained(save_dir)
+    print(f"   ✅ Saved to {save_dir}")
+
+
+# --- ONNX RUNTIME SETTINGS ---
+def session_options():
+    import onnxruntime as ort
+
+    # Up to NUM_THREADS cores for the matmuls; a single inter-op thread avoids oversubscription
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = NUM_THREADS
+    options.inter_op_num_threads = 1
+    return options
+
+
+# --- ENCODER (drop-in for SentenceTransformer.encode) ---
+class OnnxEncoder:
+    def __init__(self, model_dir=MODEL_DIR):
+        from transformers import AutoTokenizer
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name=QUANTIZED_FILE, session_options=session_options()
+        )
+        # Fast tokenizers raise "Already borrowed" when called from two threads at once
+        self._tokenizer_lock = threading.Lock()
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=True,
+               convert_to_numpy=True, show_progress_bar=False):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        chunks = []
+        for start in range(0, len(sentences), batch_size):
+            # Don't spend tokenizer time on text the model will cut off
+            batch = [text[:MAX_CHARS] for text in sentences[start:start + batch_size]]
+            with self._tokenizer_lock:
+                inputs = self.tokenizer(batch, padding=True, truncation=True,
+                                        max_length=MAX_SEQ_LENGTH, return_tensors="np")
+            hidden = self.model(**inputs).last_hidden_state
+
+            # Mean pooling over real tokens, then L2 norm (matches the MiniLM pipeline)
+            mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            chunks.append(pooled.astype(np.float32))
+
+        embeddings = np.concatenate(chunks) if chunks else np.empty((0, 384), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+    def warmup(self):
+        # First run() allocates buffers / picks kernels; do it before a real request
+        self.encode("warmup")
+
+
+# --- CUDA ENCODER (fp16 SentenceTransformer, same contract as OnnxEncoder) ---
+FP16_MAX_DRIFT = 1e-3  # max cosine distance allowed between fp32 and fp16 vectors
+DRIFT_PROBES = [
+    "NVDA stock news",
+    "Why is Tesla moving today?",
+    "Apple shares slip after the company reports weaker iPhone sales in China.",
+]
+
+class CudaEncoder:
+    def __init__(self, model_id=MODEL_ID):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_id, device="cuda")
+        # SentenceTransformer tokenizes inside encode(), so the whole call is serialised
+        self._lock = threading.Lock()
+
+        # Only keep fp16 if it stays within FP16_MAX_DRIFT of the fp32 vectors
+        reference = self.encode(DRIFT_PROBES)
+        self.model.half()
+        drift = float(1 - (reference * self.encode(DRIFT_PROBES)).sum(axis=1).min())
+        if drift > FP16_MAX_DRIFT:
+            print(f"   ⚠️ fp16 cosine drift {drift:.2e} > {FP16_MAX_DRIFT:.0e}, staying on fp32")
+            self.model.float()
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=True,
+               convert_to_numpy=True, show_progress_bar=False):
+        # Same trim as OnnxEncoder: don't tokenize text the model will cut off
+        if isinstance(sentences, str):
+            sentences = sentences[:MAX_CHARS]
+        else:
+            sentences = [text[:MAX_CHARS] for text in sentences]
+        with self._lock:
+            embeddings = self.model.encode(sentences, batch_size=batch_size,
+                                           normalize_embeddings=normalize_embeddings,
+                                           convert_to_numpy=True, show_progress_bar=False)
+        return embeddings.astype(np.float32)
+
+    def warmup(self):
+        self.encode("warmup")
+
+
+# --- STORAGE FORMAT ---
+def to_halfvec(embedding):
+    # pgvector text literal ("[0.0123,...]") for the halfvec(384) column. fp16 only
+    # holds ~3-4 significant digits, so printing more would just pad the JSON payload.
+    values = np.asarray(embedding, dtype=np.float16).astype(np.float32)
+    return "[" + ",".join(map("{:.5g}".format, values.tolist())) + "]"
+
+
+def load_encoder(model_dir=MODEL_DIR):
+    import torch
+
+    # GPU hosts: fp16 PyTorch on CUDA is far faster than int8 ONNX on CPU
+    if torch.cuda.is_available():
+        encoder = CudaEncoder()
+        encoder.warmup()
+        return encoder
+
+    if not os.path.exists(os.path.join(model_dir, QUANTIZED_FILE)):
+        export_quantized_model(save_dir=model_dir)
+    encoder = OnnxEncoder(model_dir)
+    encoder.warmup()
+    return encoder
+
+
+if __name__ == "__main__":
+    export_quantized_model()
@@ -1,9 +1,10 @@
 import os
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import yfinance as yf
 from duckduckgo_search import DDGS
-from sentence_transformers import SentenceTransformer
+from encoder import load_encoder, to_halfvec
+from search import search_ddgs
 from supabase import create_client, Client
 
 # --- SETUP ---
@@ -16,40 +17,57 @@ if not url or not key:
 supabase: Client = create_client(url, key)
 
 print("🧠 Loading AI Model (MiniLM)...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
+model = load_encoder()
 
-def fetch_and_store_data(ticker):
+INSERT_CHUNK_SIZE = 500  # rows per PostgREST insert
+MAX_WORKERS = 4  # tickers in flight at once; DuckDuckGo rate-limits bursts
+
+# One DDGS session per worker thread, reused for every ticker that thread handles
+_worker = threading.local()
+
+def get_ddgs():
+    if not hasattr(_worker, "ddgs"):
+        _worker.ddgs = DDGS()
+    return _worker.ddgs
+
+def fetch_and_store_data(ticker, ddgs):
     print(f"\n🚀 Processing {ticker}...")
     
     # 1. Get News via DuckDuckGo
-    results = []
     try:
-        with DDGS() as ddgs:
-            news_gen = ddgs.text(f"{ticker} stock news", max_results=5)
-            for r in news_gen:
-                results.append(r)
+        # Same backend fallback + backoff as the app; the pool puts bursts on DuckDuckGo
+        results = search_ddgs(ticker, ddgs)
     except Exception as e:
         print(f"   ⚠️ Search failed for {ticker}: {e}")
         return
 
-    # 2. Vectorize & Save
-    count = 0
-    for article in results:
-        # Create text chunk
-        full_text = f"{article['title']}. {article['body']}"
-        embedding = model.encode(full_text).tolist()
-        
-        data = {
+    # 2. Vectorize (one batched forward pass) & Save
+    texts = [f"{article['title']}. {article['body']}" for article in results]
+    embeddings = model.encode(texts, batch_size=32, convert_to_numpy=True,
+                              normalize_embeddings=True, show_progress_bar=False)
+
+    now_iso = datetime.utcnow().isoformat()
+    rows = [
+        {
             "ticker": ticker.upper(),
             "headline": article['title'],
             "content": article['body'],
-            "published_at": datetime.utcnow().isoformat(),
-            "embedding": embedding
+            "published_at": now_iso,
+            "embedding_half": to_halfvec(embedding)
         }
-        
+        for article, embedding in zip(results, embeddings)
+    ]
+
+    # One insert per chunk instead of one HTTPS round-trip per article
+    count = 0
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
         try:
-            supabase.table('market_news').insert(data).execute()
-            count += 1
+            # Re-runs skip articles already stored for the ticker; .data only holds new rows
+            response = supabase.table('market_news') \
+                .upsert(chunk, on_conflict='ticker,headline', ignore_duplicates=True) \
+                .execute()
+            count += len(response.data)
         except Exception as e:
             print(f"   ❌ DB Error: {e}")
             
@@ -59,12 +77,9 @@ if __name__ == "__main__":
     # Add your stocks here
     watchlist = ["NVDA", "TSLA", "AAPL", "AMD", "MSFT", "PLTR", "COIN"]
     
-    for symbol in watchlist:
-        fetch_and_store_data(symbol)
-        time.sleep(3) # Polite delay
-    
     print("--- Starting ETL Job ---")
-    for symbol in watchlist:
-        fetch_and_store_data(symbol)
+    # Each ticker is mostly waiting on DuckDuckGo / Supabase, so overlap them
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(watchlist))) as executor:
+        list(executor.map(lambda symbol: fetch_and_store_data(symbol, get_ddgs()), watchlist))
         
     print("\n--- ETL Job Complete ---")
\ No newline at end of file
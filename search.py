@@ -0,0 +1,25 @@
+import time
+# duckduckgo_search is imported where it's used, so importing this module stays cheap
+
+# --- DUCKDUCKGO SEARCH (with rate-limit fallback) ---
+DDGS_BACKENDS = ("auto", "html", "lite")
+
+
+def search_ddgs(ticker, ddgs=None):
+    from duckduckgo_search import DDGS
+    from duckduckgo_search.exceptions import DuckDuckGoSearchException
+
+    # Reuse the caller's session if given (etl.py keeps one per worker thread)
+    if ddgs is None:
+        with DDGS() as session:
+            return search_ddgs(ticker, session)
+
+    for attempt, backend in enumerate(DDGS_BACKENDS):
+        try:
+            return list(ddgs.text(f"{ticker} stock news", max_results=5, backend=backend))
+        except DuckDuckGoSearchException as e:
+            # Rate limits, timeouts and backend errors all fall through to the next backend
+            last_error = e
+            if attempt < len(DDGS_BACKENDS) - 1:
+                time.sleep(2 ** attempt)
+    raise DuckDuckGoSearchException(f"All DuckDuckGo backends failed for {ticker}") from last_error